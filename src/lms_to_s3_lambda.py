@@ -1,9 +1,14 @@
 import pandas as pd
 import urllib3
 import json
+import orjson
 import logging
 import boto3
+from boto3.s3.transfer import TransferConfig
+import io
 import os
+from types import MappingProxyType
+from concurrent.futures import ThreadPoolExecutor
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -12,6 +17,19 @@ logger = logging.getLogger()
 # Initialize a session with AWS credentials
 session = boto3.Session()
 
+# AWS clients created once and reused across warm Lambda invocations
+_s3 = session.client('s3')
+_sns = session.client('sns')
+
+# Maximum number of LMS requests in flight at once
+MAX_CONCURRENT_REQUESTS = 8
+
+# Multipart settings for streaming uploads to S3
+S3_TRANSFER_CONFIG = TransferConfig(multipart_threshold=8 * 1024 * 1024, multipart_chunksize=8 * 1024 * 1024)
+
+# Shared HTTP connection pool, reused across warm Lambda invocations
+_http = urllib3.PoolManager(num_pools=2, maxsize=MAX_CONCURRENT_REQUESTS, retries=urllib3.Retry(3, backoff_factor=0.2))
+
 # Obtain an access token from the LMS API use to extract the data
 def get_access_token():
     url = f"{os.environ.get('REST_API_URL')}/authenticate"
@@ -22,12 +40,11 @@ def get_access_token():
     })
     
     headers = {"x-api-key": os.environ.get("LMS_PRIVATE_KEY"), "x-api-version":"2"}
-    http = urllib3.PoolManager()
-    response = http.request('POST', url, body=payload, headers=headers)
+    response = _http.request('POST', url, body=payload, headers=headers)
     
     if response.status == 200:
         logger.info("Retrieved access token successfully!")
-        return json.loads(response.data.decode('utf-8'))
+        return orjson.loads(response.data)
     else:
         logger.error("Failed to obtain access token in get_access_token", exc_info=True)
         raise Exception("Failed to obtain access token")
@@ -40,16 +57,49 @@ def extract_data(endpoint, access_token, params=None):
         "x-api-key": os.environ.get("LMS_PRIVATE_KEY"),
         "x-api-version": "2"
     }
-    http = urllib3.PoolManager()
-    response = http.request('GET', url, headers=headers, fields=params)
+    response = _http.request('GET', url, headers=headers, fields=params)
     
     if response.status == 200:
-        logger.info(f"Retrieved data from {endpoint} endpoint successfully!")
-        return json.loads(response.data.decode('utf-8'))
+        logger.info("Retrieved data from %s endpoint successfully!", endpoint)
+        return orjson.loads(response.data)
     else:
         logger.error("Failed to retrieve data in extract_data", exc_info=True)
         raise Exception("Failed to retrieve data")
 
+# Fetch all pages of a paginated LMS endpoint, requesting the remaining pages concurrently
+def extract_all_pages(endpoint, access_token, params=None, items_key='users'):
+    """
+    Fetches every page of a paginated endpoint and merges the items into the first page.
+
+    Parameters:
+    endpoint (str): The API endpoint to fetch.
+    access_token (str): The bearer token used for authorization.
+    params (dict): Query parameters sent with every page request.
+    items_key (str): The key holding the list of items in each page.
+
+    Returns:
+    dict: The first page with the items of all pages appended to it.
+    """
+    params = dict(params or {})
+    first_page = extract_data(endpoint, access_token, params=params)
+
+    limit = first_page.get('limit')
+    total_items = first_page.get('totalItems')
+    if not limit or not total_items:
+        return first_page
+
+    offsets = range((first_page.get('offset') or 0) + limit, total_items, limit)
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as executor:
+        pages = executor.map(
+            lambda offset: extract_data(endpoint, access_token, params={**params, 'limit': limit, 'offset': offset}),
+            offsets
+        )
+        for page in pages:
+            first_page[items_key].extend(page[items_key])
+
+    logger.info("Retrieved %d of %d items from %s endpoint", len(first_page[items_key]), total_items, endpoint)
+    return first_page
+
 # Determine the API endpoint based on the data type and id(optional)
 def get_api_endpoint(data, additional_id=''):
     endpoints = {
@@ -67,7 +117,8 @@ def get_api_endpoint(data, additional_id=''):
         
 def process_users_data(users_data):
     """
-    Processes the users_data by removing specified columns and flattening the users.
+    Processes the users_data by removing specified columns and building one column per user field.
+    Custom fields are collected into a single 'custom_fields' column of dicts.
 
     Parameters:
     users_data (dict): The data containing user information.
@@ -79,11 +130,63 @@ def process_users_data(users_data):
     for key in ['totalItems', 'limit', 'offset', 'returnedItems']:
         users_data.pop(key, None)
 
-    # Flatten the users data
-    users_df = pd.json_normalize(users_data['users'])
+    users = users_data['users']
+
+    # Keep every top-level field in first-seen order; missing fields become None
+    fields = [field for field in dict.fromkeys(field for user in users for field in user) if field != 'customFields']
+    columns = {field: [user.get(field) for user in users] for field in fields}
+
+    # Consolidate custom fields into a single column, keyed as 'customFields.<name>' and skipping empty values
+    columns['custom_fields'] = [
+        {f'customFields.{name}': value for name, value in (user.get('customFields') or {}).items() if value is not None}
+        for user in users
+    ]
+
+    users_df = pd.DataFrame(columns)
 
     return users_df
 
+# Mapping of LMS field names to database column names, built once at import
+_CONVERSION_DICT = MappingProxyType({
+    'id': 'lms_user_id',
+    'departmentId': 'department_id',
+    'firstName': 'first_name',
+    'middleName': 'middle_name',
+    'lastName': 'last_name',
+    'username': 'user_name',
+    'password': 'password',
+    'emailAddress': 'email_address',
+    'externalId': 'illum_id',
+    'ccEmailAddresses': 'cc_email_addresses',
+    'languageId': 'language_id',
+    'gender': 'gender',
+    'address': 'address',
+    'address2': 'address_2',
+    'city': 'city',
+    'provinceId': 'province_id',
+    'countryId': 'country_id',
+    'postalCode': 'postal_code',
+    'phone': 'phone',
+    'employeeNumber': 'employee_number',
+    'location': 'location',
+    'jobTitle': 'job_title',
+    'referenceNumber': 'reference_number',
+    'dateHired': 'date_hired',
+    'dateTerminated': 'date_terminated',
+    'dateEdited': 'date_edited',
+    'dateAdded': 'date_added',
+    'lastLoginDate': 'last_login_date',
+    'notes': 'notes',
+    'roleIds': 'role_ids',
+    'activeStatus': 'active_status',
+    'isLearner': 'is_learner',
+    'isAdmin': 'is_admin',
+    'isInstructor': 'is_instructor',
+    'isManager': 'is_manager',
+    'supervisorId': 'supervisor_id',
+    'hasUsername': 'has_user_name'
+})
+
 # Function to convert column names of a DataFrame
 def convert_column_names(df):
     """
@@ -96,78 +199,44 @@ def convert_column_names(df):
     pd.DataFrame: A DataFrame with renamed columns.
     """
     try:
-        conversion_dict = {
-            'id': 'lms_user_id',
-            'departmentId': 'department_id',
-            'firstName': 'first_name',
-            'middleName': 'middle_name',
-            'lastName': 'last_name',
-            'username': 'user_name',
-            'password': 'password',
-            'emailAddress': 'email_address',
-            'externalId': 'illum_id',
-            'ccEmailAddresses': 'cc_email_addresses',
-            'languageId': 'language_id',
-            'gender': 'gender',
-            'address': 'address',
-            'address2': 'address_2',
-            'city': 'city',
-            'provinceId': 'province_id',
-            'countryId': 'country_id',
-            'postalCode': 'postal_code',
-            'phone': 'phone',
-            'employeeNumber': 'employee_number',
-            'location': 'location',
-            'jobTitle': 'job_title',
-            'referenceNumber': 'reference_number',
-            'dateHired': 'date_hired',
-            'dateTerminated': 'date_terminated',
-            'dateEdited': 'date_edited',
-            'dateAdded': 'date_added',
-            'lastLoginDate': 'last_login_date',
-            'notes': 'notes',
-            'roleIds': 'role_ids',
-            'activeStatus': 'active_status',
-            'isLearner': 'is_learner',
-            'isAdmin': 'is_admin',
-            'isInstructor': 'is_instructor',
-            'isManager': 'is_manager',
-            'supervisorId': 'supervisor_id',
-            'hasUsername': 'has_user_name'
-        }
+        # Assign the new labels directly instead of going through df.rename
+        df.columns = [_CONVERSION_DICT.get(col, col) for col in df.columns]
         logger.info("Convert all the columns name")
-        return df.rename(columns=conversion_dict)
+        return df
     except Exception as e:
         logger.error(f"Error converting column names: {e}", exc_info=True)
         raise Exception(f"Error converting column names: {str(e)}")
 
-# Function to consolidate custom fields into a single column
-def consolidate_custom_fields(df):
+# Function to normalize object columns so they can be stored as flat, single-typed Parquet columns
+def normalize_object_columns(df):
     """
-    Consolidates custom fields into a single JSON column.
+    JSON-encodes every column holding dicts or lists (e.g. custom_fields, role_ids) and casts
+    columns mixing scalar types (e.g. postal codes sent as str for some users and int for others)
+    to strings, since Parquet requires one type per column.
     
     Parameters:
-    df (pd.DataFrame): The DataFrame containing custom fields.
+    df (pd.DataFrame): The DataFrame containing nested or mixed-type values.
     
     Returns:
-    pd.DataFrame: A DataFrame with a single 'custom_fields' column.
+    pd.DataFrame: A DataFrame whose object columns each hold a single type.
     """
     try:
-        custom_fields_columns = [col for col in df.columns if col.startswith('customFields.')]
-        df['custom_fields'] = df[custom_fields_columns].apply(lambda row: row.dropna().to_dict(), axis=1)
-        df = df.drop(columns=custom_fields_columns)
-        logger.info("Consolilate all the json columns into 1")
+        for column in df.select_dtypes(include='object').columns:
+            if df[column].map(lambda x: isinstance(x, (dict, list))).any():
+                df[column] = df[column].map(lambda x: json.dumps(x) if isinstance(x, (dict, list)) else x)
+            if df[column].dropna().map(type).nunique() > 1:
+                df[column] = df[column].astype('string')
+        logger.info("Normalized object columns for Parquet")
         return df
     except Exception as e:
-        logger.error(f"Error consolidating custom fields: {e}", exc_info=True)
-        raise Exception(f"Error consolidating custom fields: {str(e)}")
+        logger.error(f"Error normalizing object columns: {e}", exc_info=True)
+        raise Exception(f"Error normalizing object columns: {str(e)}")
 
-# Function to upload data to an S3 bucket
-def upload_to_s3(data, bucket_name, file_path):
-    """Upload data to an S3 bucket."""
-    s3_client = session.client('s3')
+# Function to upload a file-like object to an S3 bucket
+def upload_to_s3(fileobj, bucket_name, file_path):
+    """Upload a binary file-like object to an S3 bucket, using multipart upload for large payloads."""
     try:
-        s3_client.put_object(Bucket=bucket_name, Key=file_path, Body=data)
+        _s3.upload_fileobj(fileobj, bucket_name, file_path, Config=S3_TRANSFER_CONFIG)
         logger.info(f"Uploaded data to s3://{bucket_name}/{file_path}")
     except Exception as e:
         logger.error(f"Failed to upload data to S3: {e}", exc_info=True)
@@ -176,9 +245,8 @@ def upload_to_s3(data, bucket_name, file_path):
 # Send an SNS notification with the given message
 def send_sns_notification(message):
     """Send an SNS notification with the given subject and message."""
-    sns_client = session.client('sns')
     try:
-        sns_client.publish(
+        _sns.publish(
             TopicArn=os.environ.get("SNS_TOPIC_ARN"),
             Subject='Slack Notification',
             Message= f'6fr-etl-lambda failed: {message}'
@@ -197,19 +265,21 @@ def lambda_handler(event, context):
         params = {
             "_filter": "departmentId eq guid'department_id'"
         }
-        users_data = extract_data(get_api_endpoint("list_users"), access_token, params=params)
+        users_data = extract_all_pages(get_api_endpoint("list_users"), access_token, params=params)
         
         full_users_df = process_users_data(users_data)
         
         # Convert column names
         full_users_df = convert_column_names(full_users_df)
-        
-        # Consolidate custom fields into a single column
-        full_users_df = consolidate_custom_fields(full_users_df)
 
-        # Convert DataFrame to CSV and upload to S3
-        csv_data = full_users_df.to_csv(index=False)
-        upload_to_s3(csv_data, os.environ.get("S3_BUCKET_NAME"), os.environ.get("S3_DEPARTMENT_MEMBERS_PATH"))
+        # Encode nested values as JSON and unify mixed-type columns so they fit in flat Parquet columns
+        full_users_df = normalize_object_columns(full_users_df)
+
+        # Write the DataFrame as zstd-compressed Parquet (low level keeps CPU cheap) and stream it to S3
+        parquet_buffer = io.BytesIO()
+        full_users_df.to_parquet(parquet_buffer, engine='pyarrow', compression='zstd', compression_level=1, index=False)
+        parquet_buffer.seek(0)
+        upload_to_s3(parquet_buffer, os.environ.get("S3_BUCKET_NAME"), os.environ.get("S3_DEPARTMENT_MEMBERS_PATH"))
 
         return {
             'statusCode': 200,
@@ -1,13 +1,13 @@
 import json
 import boto3
 import pandas as pd
-from sqlalchemy import create_engine, text, inspect
+from sqlalchemy import create_engine, inspect
 import os
 import logging
-from io import StringIO
+import functools
+from io import BytesIO, StringIO
 from datetime import datetime
 import pytz
-import numpy as np
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -16,80 +16,160 @@ logger = logging.getLogger()
 # Initialize a session with AWS credentials
 session = boto3.Session()
 
+# AWS clients created once and reused across warm Lambda invocations
+_s3 = session.client('s3')
+_sns = session.client('sns')
+
+# Engine and table schemas cached at module scope so warm Lambda invocations reuse them
+_engine = None
+_SCHEMA_CACHE = {}
+
 # Function to create a SQLAlchemy engine for the business tracking database
 def create_db_engine():
-    db_url = f"postgresql://{os.environ.get('RDS_USER')}:{os.environ.get('RDS_PASSWORD')}@" \
-             f"{os.environ.get('RDS_HOST')}:{os.environ.get('RDS_PORT')}/" \
-             f"{os.environ.get('RDS_DBNAME')}?sslmode={os.environ.get('RDS_SSLMODE')}"
-    engine = create_engine(db_url) 
-    logger.info("SQLAlchemy engine created for business tracking database.")
-    return engine
+    global _engine
+    if _engine is None:
+        db_url = f"postgresql://{os.environ.get('RDS_USER')}:{os.environ.get('RDS_PASSWORD')}@" \
+                 f"{os.environ.get('RDS_HOST')}:{os.environ.get('RDS_PORT')}/" \
+                 f"{os.environ.get('RDS_DBNAME')}?sslmode={os.environ.get('RDS_SSLMODE')}"
+        # Pre-ping revalidates pooled connections after the container thaws; recycle stays under idle timeouts
+        _engine = create_engine(db_url, pool_pre_ping=True, pool_recycle=300, pool_size=2, max_overflow=0)
+        logger.info("SQLAlchemy engine created for business tracking database.")
+    return _engine
 
 # Function to retrieve the schema of the destination table
 def get_table_schema(engine, schema, table_name):
     """Retrieve the schema of the destination table including column names and data types."""
-    inspector = inspect(engine)
-    columns = inspector.get_columns(table_name, schema=schema)
-    schema_info = {col['name']: col['type'] for col in columns}
-    logger.info(f"Schema for table {table_name}: {schema_info}")
+    cache_key = (schema, table_name)
+    if cache_key not in _SCHEMA_CACHE:
+        inspector = inspect(engine)
+        columns = inspector.get_columns(table_name, schema=schema)
+        _SCHEMA_CACHE[cache_key] = {col['name']: col['type'] for col in columns}
+    schema_info = _SCHEMA_CACHE[cache_key]
+    # Rendering the full schema is only worth it when debugging
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Schema for table %s: %s", table_name, schema_info)
     return schema_info
 
-# Function to convert DataFrame data types to match the destination table schema
-def convert_dataframe_dtypes(df, schema_info):
-    """Convert DataFrame data types to match the destination table schema."""
-        # Remove '.0' from all columns ending with 'id'
-    for column in df.columns:
-        #if column.endswith('id') or column.endswith('code'):
-        df[column] = df[column].apply(lambda x: str(x).replace('.0', '') if isinstance(x, float) else x)
-
-    for column, dtype in schema_info.items():
-        if column in df.columns:
+# Per-type converters producing the final column dtype in a single pass
+def _to_integer(series):
+    # Nullable Int64 keeps missing values as pd.NA (NULL in PostgreSQL)
+    return pd.to_numeric(series, errors='coerce').astype('Int64')
+
+def _to_text(series):
+    # Whole-number floats (e.g. codes in a column with blanks) must not gain a '.0' suffix
+    if pd.api.types.is_float_dtype(series) and (series.dropna() % 1 == 0).all():
+        series = series.astype('Int64')
+    # Replace missing values with empty strings
+    return series.astype('string').fillna(' ')
+
+# String forms of booleans accepted in BOOLEAN columns, compared case-insensitively
+_BOOLEAN_STRINGS = {'true': True, 't': True, 'yes': True, '1': True, 'false': False, 'f': False, 'no': False, '0': False}
+
+def _to_boolean(series):
+    # The nullable boolean cast only takes bool-like values, so map string forms first
+    if not pd.api.types.is_bool_dtype(series):
+        series = series.map(lambda x: _BOOLEAN_STRINGS.get(x.strip().lower(), x) if isinstance(x, str) else x)
+    return series.astype('boolean')
+
+def _json_value(value):
+    if isinstance(value, str):
+        # Dicts and lists arrive JSON-encoded by the producer and are passed through unchanged;
+        # any other string is a plain value and still needs quoting
+        if value[:1] in ('{', '['):
             try:
-                if 'INTEGER' in str(dtype) or 'BIGINT' in str(dtype):
-                    df[column] = pd.to_numeric(df[column], errors='coerce').astype('Int64')
-                    # Replace NaN with None (which translates to NULL in PostgreSQL)
-                    df[column] = df[column].replace({np.nan: None})
-                elif 'VARCHAR' in str(dtype) or 'TEXT' in str(dtype):
-                    # Replace 'nan' with empty strings
-                    df[column] = df[column].astype(str)
-                    df[column].replace({'nan': ' '}, inplace=True)
-                elif 'BOOLEAN' in str(dtype):
-                    df[column] = df[column].astype(bool)
-                elif 'DATE' in str(dtype) or 'TIMESTAMP' in str(dtype):
-                    df[column] = pd.to_datetime(df[column], errors='coerce').dt.tz_localize('UTC')
-                elif 'JSON' in str(dtype):
-                    df[column] = df[column].apply(lambda x: json.dumps(x) if not pd.isna(x) else None)
-                logger.info(f"Converted column '{column}' to {dtype}.")
-            except Exception as e:
-                logger.error(f"Failed to convert column '{column}' to {dtype}: {e}", exc_info=True)
-                raise Exception(f"Failed to convert column '{column}' to {dtype}: {str(e)}")
+                json.loads(value)
+                return value
+            except ValueError:
+                pass
+        return json.dumps(value)
+    return json.dumps(value) if not pd.isna(value) else None
+
+def _to_json(series):
+    return series.map(_json_value)
+
+# SQL type keywords mapped to their converter, matched in order against the column type.
+# DATE/TIMESTAMP columns are left to parse_datetime_columns, which parses them exactly once.
+_DTYPE_CONVERTERS = {
+    'INTEGER': _to_integer,
+    'BIGINT': _to_integer,
+    'SMALLINT': _to_integer,
+    'VARCHAR': _to_text,
+    'TEXT': _to_text,
+    'BOOLEAN': _to_boolean,
+    'JSON': _to_json,
+}
 
+# Function to convert DataFrame data types to match the destination table schema
+def convert_dataframe_dtypes(df, targets):
+    """Convert DataFrame data types to match the destination table schema, given (column, SQL type) pairs present in the DataFrame."""
+    for column, sql_type in targets:
+        converter = next((func for keyword, func in _DTYPE_CONVERTERS.items() if keyword in sql_type), None)
+        if converter is None:
+            continue
+        try:
+            df[column] = converter(df[column])
+            logger.info("Converted column '%s' to %s.", column, sql_type)
+        except Exception as e:
+            logger.error(f"Failed to convert column '{column}' to {sql_type}: {e}", exc_info=True)
+            raise Exception(f"Failed to convert column '{column}' to {sql_type}: {str(e)}")
+
+
+# Function to build the staging and upsert statements for a table, cached per column layout
+@functools.lru_cache(maxsize=16)
+def _build_upsert_sql(schema, table_name, columns, unique_key):
+    """Return the CREATE TEMP TABLE, COPY and INSERT ... ON CONFLICT statements for the given columns."""
+    staging_table = f"_stg_{table_name}"
+    column_list = ', '.join([f'"{col}"' for col in columns])
+    update_clause = ', '.join([f'"{col}" = EXCLUDED."{col}"' for col in columns if col != unique_key])
+
+    # Ensure schema and table names are properly quoted to avoid syntax errors
+    # The staging table holds only the copied columns, without constraints or defaults, so columns the
+    # DataFrame does not carry (serial keys, created_at defaults, ...) are still filled in by the target
+    create_stmt = f'CREATE TEMP TABLE "{staging_table}" ON COMMIT DROP AS ' \
+                  f'SELECT {column_list} FROM "{schema}"."{table_name}" WITH NO DATA'
+    copy_stmt = f"""COPY "{staging_table}" ({column_list}) FROM STDIN WITH (FORMAT CSV, NULL '\\N')"""
+    upsert_stmt = f"""
+        INSERT INTO "{schema}"."{table_name}" ({column_list})
+        SELECT {column_list} FROM "{staging_table}"
+        ON CONFLICT ("{unique_key}") DO UPDATE SET
+        {update_clause}
+    """
+    return create_stmt, copy_stmt, upsert_stmt
 
 # Function to upsert a DataFrame into a PostgreSQL table
 def upsert_dataframe_to_postgres(df, table_name, engine, unique_key, schema):
-    """Upsert a DataFrame into a PostgreSQL table."""
-    with engine.connect() as connection:
-        try:
-            # Ensure schema and table names are properly quoted to avoid syntax errors
-            upsert_stmt = text(f"""
-                INSERT INTO "{schema}"."{table_name}" ({', '.join([f'"{col}"' for col in df.columns])})
-                VALUES ({', '.join([f':{col}' for col in df.columns])})
-                ON CONFLICT ("{unique_key}") DO UPDATE SET
-                {', '.join([f'"{col}" = EXCLUDED."{col}"' for col in df.columns if col != unique_key])}
-            """)
-            with connection.begin() as transaction:
-                connection.execute(upsert_stmt, df.to_dict(orient='records'))
-            logger.info(f"Data upserted to {table_name} successfully.")
-        except Exception as e:
-            logger.error(f"An error occurred: {e}", exc_info=True)
-            raise Exception(f"An error occurred during upsert: {str(e)}")
+    """Upsert a DataFrame into a PostgreSQL table by COPYing it into a staging table and merging from there."""
+    create_stmt, copy_stmt, upsert_stmt = _build_upsert_sql(schema, table_name, tuple(df.columns), unique_key)
+
+    # A single INSERT cannot update the same row twice, so keep the last row per key;
+    # only copy the frame when there actually are duplicates
+    duplicated = df[unique_key].duplicated(keep='last')
+    if duplicated.any():
+        df = df[~duplicated]
+    csv_buffer = StringIO()
+    df.to_csv(csv_buffer, index=False, header=False, na_rep='\\N')
+    csv_buffer.seek(0)
+
+    raw_connection = engine.raw_connection()
+    try:
+        cursor = raw_connection.cursor()
+        cursor.execute(create_stmt)
+        cursor.copy_expert(copy_stmt, csv_buffer)
+        cursor.execute(upsert_stmt)
+        raw_connection.commit()
+        logger.info(f"Data upserted to {table_name} successfully.")
+    except Exception as e:
+        raw_connection.rollback()
+        logger.error(f"An error occurred: {e}", exc_info=True)
+        raise Exception(f"An error occurred during upsert: {str(e)}")
+    finally:
+        raw_connection.close()
 
 # Send an SNS notification with the given message
 def send_sns_notification(message):
     """Send an SNS notification with the given subject and message."""
-    sns_client = session.client('sns')
     try:
-        sns_client.publish(
+        _sns.publish(
             TopicArn=os.environ.get("SNS_TOPIC_ARN"),
             Subject='Slack Notification',
             Message= f'6fr-s3-to-rds failed: {message}'
@@ -101,14 +181,13 @@ def send_sns_notification(message):
 
 # Function to retrieve data from S3
 def retrieve_data_from_s3():
-    """Retrieve data from S3 and return as a DataFrame."""
-    s3_client = session.client('s3')
+    """Retrieve Parquet data from S3 and return as a DataFrame."""
     bucket_name = os.environ.get("S3_BUCKET_NAME")
     file_path = os.environ.get("S3_DEPARTMENT_MEMBERS_PATH")
     
-    response = s3_client.get_object(Bucket=bucket_name, Key=file_path)
-    data = response['Body'].read().decode('utf-8')
-    df = pd.read_csv(StringIO(data))
+    response = _s3.get_object(Bucket=bucket_name, Key=file_path)
+    # Parquet needs a seekable file, so buffer the body once in memory
+    df = pd.read_parquet(BytesIO(response['Body'].read()), engine='pyarrow')
     logger.info("Data retrieved from S3 successfully.")
     return df
 
@@ -117,14 +196,14 @@ def parse_datetime_columns(df, column_names):
     """Parse ISO 8601 datetime strings in the specified columns of a DataFrame."""
     for column_name in column_names:
         try:
-            df[column_name] = pd.to_datetime(df[column_name], format='%m-%d-%Y %H:%M:%S', errors='coerce')
-            if df[column_name].dt.tz is None:
-                df[column_name] = df[column_name].dt.tz_localize('UTC')
-            else:
-                df[column_name] = df[column_name].dt.tz_convert('UTC')
-            # Convert NaT to None
-            df[column_name] = df[column_name].replace({pd.NaT: None})
-            logger.info(f"Parsed datetime column '{column_name}' successfully.")
+            # utc=True localizes naive values and converts aware ones in the same pass;
+            # NaT is kept as is and written as NULL by the COPY upsert
+            try:
+                df[column_name] = pd.to_datetime(df[column_name], format='%m-%d-%Y %H:%M:%S', utc=True)
+            except (ValueError, TypeError):
+                # Values in another layout (e.g. ISO 8601) fall back to format inference
+                df[column_name] = pd.to_datetime(df[column_name], errors='coerce', utc=True)
+            logger.info("Parsed datetime column '%s' successfully.", column_name)
         except Exception as e:
             logger.error(f"Failed to parse datetime column '{column_name}': {e}", exc_info=True)
             raise Exception(f"Failed to parse datetime column '{column_name}': {str(e)}")
@@ -132,17 +211,19 @@ def parse_datetime_columns(df, column_names):
 def lambda_handler(event, context):
     """Lambda function to retrieve data from S3 and upsert it to RDS"""
     try:
-        # Retrieve data from S3
-        df = retrieve_data_from_s3()
-
         # Create database engine
         engine = create_db_engine()
 
         # Retrieve schema of the destination table
         schema_info = get_table_schema(engine, os.environ.get("RDS_SCHEMA"), 'department_members')
 
-        # Convert DataFrame data types to match the destination table schema
-        convert_dataframe_dtypes(df, schema_info)
+        # Retrieve data from S3
+        df = retrieve_data_from_s3()
+
+        # Convert DataFrame data types to match the destination table schema, limited to the columns present
+        df_columns = set(df.columns)
+        targets = [(column, str(dtype)) for column, dtype in schema_info.items() if column in df_columns]
+        convert_dataframe_dtypes(df, targets)
 
         # Parse datetime column
         parse_datetime_columns(df, ['date_hired','date_terminated','date_edited','date_added','last_login_date'])